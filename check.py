@@ -21,29 +21,45 @@
 #  MA 02110-1301, USA.
 #
 #
-"""Check URLs for responses"""
-import urllib3 as url3
+"""Check URLs for responses
+
+   urllib3 and icmplib are only imported by the functions that send probes,
+   so that check_main() and anything else that imports this module do not pay for them.
+   Likewise, notify (and export, which needs it) pull in asyncio, so they are only imported
+   by the functions that use them, and probe workers and the API process stay small.
+"""
 import multiprocessing as mp
 import time
 import json
 import queue
 import os
-import icmplib as icmp
+import multiprocessing.connection
+from concurrent.futures import ThreadPoolExecutor, FIRST_COMPLETED, wait as wait_futures
 import comms
-import copy
+import common
+import federation
+import ratelimit
+import simulate
+import profiling
+import pools
 # import threading as mt
 
 
-def advanced_check(url: str) -> bool:
+def advanced_check(url: str, timeout: float=None) -> bool:
     """This function is to perform an advanced check. Not all services support this.
        This function will send an HTTP GET request to /status at the designated URL,
        if it receives a JSON response with a 'status': True element, it will assume the service is up and working.
+       If `timeout` is set, the request is not retried and gives up after that many seconds.
     """
+    import urllib3 as url3
     http = url3.PoolManager()
+    options = {}
+    if timeout is not None:
+      options = {"timeout": url3.Timeout(total=timeout), "retries": url3.Retry(connect=0, read=0, redirect=3)}
     if url[-1] == "/":
-      data = http.request("GET", f"{url}status")
+      data = http.request("GET", f"{url}status", **options)
     else:
-      data = http.request("GET", f"{url}/status")
+      data = http.request("GET", f"{url}/status", **options)
     data = data.data.decode()
     try:
        data = json.loads(data)
@@ -61,6 +77,28 @@ def simple_check(url: str, wait: int, count: int) -> bool:
        if it receives a response within a given number of seconds, set by `wait`,
        it will assume the service is up and working.
     """
+    return simple_check_stats(url, wait, count)["up"]
+
+
+def make_outcome(up: bool, latency: float=None, loss: float=None) -> dict:
+    """Build the outcome of checking a target.
+       `latency` is in milliseconds and `loss` is the fraction of packets or requests lost.
+    """
+    if loss is None:
+       loss = 0.0 if up else 1.0
+    return {"up": up, "latency": latency, "loss": loss}
+
+
+def timed_out_outcome() -> dict:
+    """Build the outcome of a probe that did not finish before the sweep deadline.
+       That says nothing about the target, so it keeps it's last known status rather than being counted as down.
+    """
+    return dict(make_outcome(False), timed_out=True)
+
+
+def simple_check_stats(url: str, wait: int, count: int) -> dict:
+    """Same as simple_check(), but return the outcome including latency and packet loss"""
+    import icmplib as icmp
     try:
        data = icmp.ping(url, count=count, timeout=wait)
     except icmp.NameLookupError:
@@ -68,12 +106,19 @@ def simple_check(url: str, wait: int, count: int) -> bool:
     except icmp.SocketPermissionError:
        raise PermissionError("INSUFFICENT PERMISSIONS TO SEND ICMP PACKETS.")
     except icmp.ICMPSocketError:
-       return False
+       return make_outcome(False)
     if data.packets_received == 0:
-       return False
+       return make_outcome(False)
     if not data.is_alive:
-       return False
-    return True
+       return make_outcome(False, loss=data.packet_loss)
+    return make_outcome(True, data.avg_rtt, data.packet_loss)
+
+
+def advanced_check_stats(url: str, timeout: float=None) -> dict:
+    """Same as advanced_check(), but return the outcome including how long the request took"""
+    start = time.monotonic()
+    up = advanced_check(url, timeout)
+    return make_outcome(up, (time.monotonic() - start) * 1000)
 
 
 def bulk_advanced_check(urls: list) -> dict:
@@ -92,31 +137,73 @@ def bulk_simple_check(urls: list, timeout: int, count: int) -> dict:
    return results
 
 
-def cache_gen_handler(pipe) -> None:
-   """Handle Generating a new cache"""
-   settings = {}
-   to_track = {}
+def build_targets(to_track: dict) -> list:
+   """Get every (type, url) pair that needs to be checked"""
+   targets = []
+   for each in to_track:
+      if each != "misc":
+         for each1 in to_track[each]["urls"]:
+            targets.append((to_track[each]["type"], each1))
+      else:
+         for each1 in to_track["misc"]:
+            targets.append((to_track["misc"][each1]["type"], to_track["misc"][each1]["url"]))
+   return sorted(common.unique(targets))
+
+
+def probe_key(target: tuple) -> tuple:
+   """Get the probe that has to be sent to check a (type, url) target.
+      Targets written differently that need the same probe get the same key.
+   """
+   if target[0] == "simple":
+      return ("simple", common.normalize_host(target[1]))
+   return (target[0], common.normalize_url(target[1]))
+
+
+def unique_probes(targets: list) -> list:
+   """Get the probes needed to check every target, each only once"""
+   return sorted(common.unique([probe_key(each) for each in targets]))
+
+
+def fan_out(targets: list, outcomes: dict) -> dict:
+   """Give every target the outcome of it's probe.
+      Targets whose probe was not sent are left out.
+   """
+   output = {}
+   for each in targets:
+      key = probe_key(each)
+      if key in outcomes:
+         output[each] = outcomes[key]
+   return output
+
+
+def shard_targets(targets: list, workers: int) -> list:
+   """Split targets across workers using consistent hashing, so adding or removing
+      a worker only moves a small share of the targets to a different worker.
+      Targets are hashed by host, so every check of one host lands on the same
+      worker and per host rate limits hold.
+   """
+   ring = common.hash_ring(range(workers))
+   shards = [[] for each in range(workers)]
+   for each in targets:
+      shards[common.ring_lookup(ring, common.normalize_host(each[1]))[0]].append(each)
+   return shards
+
+
+def build_cache(to_track: dict, results: dict, timed_out: set=None) -> dict:
+   """Work out the status of every category from the results of checking each target.
+      Targets in `timed_out` are listed under TIMED_OUT, so it is clear their result is an old one.
+   """
+   if timed_out is None:
+      timed_out = set()
    cache = {}
-   while True:
-      data = pipe.recv()
-      if "SETTINGS" in data:
-         settings = data["SETTINGS"]
-         pipe.send("ACCEPTED")
-      elif "TO_TRACK" in data:
-         to_track = data["TO_TRACK"]
-         pipe.send("ACCEPTED")
-      elif data == "START":
-         break
-   # Check URLS
    for each in to_track:
       cache[each] = {"urls": {}}
       if each != "misc":
-         if to_track[each]["type"] == "simple":
-            for each1 in to_track[each]["urls"]:
-               cache[each]["urls"][each1] = simple_check(each1, settings["icmp"]["timeout"], settings["icmp"]["count"])
-         if to_track[each]["type"] == "advanced":
-            for each1 in to_track[each]["urls"]:
-               cache[each]["urls"][each1] = advanced_check(each1)
+         late = [each1 for each1 in to_track[each]["urls"] if (to_track[each]["type"], each1) in timed_out]
+         if late != []:
+            cache[each]["TIMED_OUT"] = late
+         for each1 in to_track[each]["urls"]:
+            cache[each]["urls"][each1] = results[(to_track[each]["type"], each1)]
          count = 0
          for each1 in to_track[each]["urls"]:
             if not cache[each]["urls"][each1]:
@@ -137,16 +224,141 @@ def cache_gen_handler(pipe) -> None:
          del cache["misc"]["urls"]
          for each1 in to_track["misc"]:
             cache["misc"][each1] = {"url": to_track["misc"][each1]["url"]}
-            if to_track["misc"][each1]["type"] == "simple":
-               cache["misc"][each1]["STATUS"] = simple_check(to_track["misc"][each1]["url"], settings["icmp"]["timeout"],
-                                                             settings["icmp"]["count"])
-            elif to_track["misc"][each1]["type"] == "advanced":
-               cache["misc"][each1]["STATUS"] = advanced_check(to_track["misc"][each1]["url"])
-   pipe.send(cache)
+            cache["misc"][each1]["STATUS"] = results[(to_track["misc"][each1]["type"], to_track["misc"][each1]["url"])]
+            if (to_track["misc"][each1]["type"], to_track["misc"][each1]["url"]) in timed_out:
+               cache["misc"][each1]["TIMED_OUT"] = True
+   return cache
+
+
+def cached_results(cache: dict, to_track: dict) -> dict:
+   """Get the last published result of every target that has one"""
+   output = {}
+   for each in to_track:
+      if each not in cache:
+         continue
+      if each != "misc":
+         for each1 in to_track[each]["urls"]:
+            if each1 in cache[each]["urls"]:
+               output[(to_track[each]["type"], each1)] = cache[each]["urls"][each1]
+      else:
+         for each1 in to_track["misc"]:
+            if (each1 in cache["misc"]) and (cache["misc"][each1]["url"] == to_track["misc"][each1]["url"]):
+               output[(to_track["misc"][each1]["type"], to_track["misc"][each1]["url"])] = cache["misc"][each1]["STATUS"]
+   return output
+
+
+def http_timeout(settings: dict) -> float:
+   """How long an HTTP check may take. Half the sweep deadline, so a hung service
+      fails it's own check rather than being killed along with the rest of the shard.
+   """
+   return settings.get("sweep_deadline", settings["check_freq"]) / 2
+
+
+def limited_check(target: tuple, settings: dict, limiter) -> dict:
+   """Check a (type, url) target once the rate limits allow it. Returns it's outcome.
+      Limits are per normalized host, so every spelling of one host shares a per_host limit.
+   """
+   host = common.normalize_host(target[1])
+   packets = 1
+   if target[0] == "simple":
+      packets = settings["icmp"]["count"]
+   net = limiter.acquire(host, packets)
+   try:
+      if target[0] == "simple":
+         return simple_check_stats(target[1], settings["icmp"]["timeout"], settings["icmp"]["count"])
+      elif target[0] == "advanced":
+         return advanced_check_stats(target[1], http_timeout(settings))
+   except PermissionError:
+      raise
+   except Exception as error:
+      # One bad target should not take the rest of the shard down with it
+      print(f"CHECK FAILED: {target[1]}: {error}")
+      return make_outcome(False)
+   finally:
+      limiter.release(host, net)
+   return make_outcome(False)
+
+
+def ranked_probes(to_track: dict) -> set:
+   """Get the pings whose latency ranks a pool. These are always sent,
+      never skipped because the host answered an HTTP check.
+   """
+   output = set()
+   for each in to_track:
+      if (each != "misc") and (to_track[each]["type"] == "simple"):
+         output.update({probe_key(("simple", each1)) for each1 in to_track[each]["urls"]})
+   return output
+
+
+def cache_gen_handler(pipe) -> None:
+   """Handle checking a shard of probes. Sends back outcomes as soon as they
+      are known, then "DONE" once every probe has been sent.
+      If a host answers an HTTP check it is reachable, so pings to it that don't
+      rank a pool wait for that check and are skipped if it passes.
+   """
+   settings = {}
+   targets = []
+   while True:
+      data = pipe.recv()
+      if "SETTINGS" in data:
+         settings = data["SETTINGS"]
+         pipe.send("ACCEPTED")
+      elif "TARGETS" in data:
+         targets = data["TARGETS"]
+         pipe.send("ACCEPTED")
+      elif data == "START":
+         break
+   session = None
+   if "profile" in settings:
+      session = profiling.Session("worker", settings["profile"], settings["profiling"]["max_seconds"],
+                                  settings["profiling"])
+   # Check URLS
+   limiter = ratelimit.ProbeLimiter(settings["rate_limit"])
+   ranked = set(settings.get("ranked_probes", []))
+   # How many HTTP checks of each host are still to finish
+   http = {}
+   if settings["icmp"].get("reuse_http", True):
+      for each in targets:
+         if each[0] == "advanced":
+            http[common.normalize_host(each[1])] = http.get(common.normalize_host(each[1]), 0) + 1
+   # Concurrency of 0 means unlimited: every probe gets its own thread
+   concurrency = settings["rate_limit"]["concurrency"]
+   if concurrency <= 0:
+      concurrency = len(targets)
+   with ThreadPoolExecutor(max_workers=max(concurrency, 1)) as pool:
+      running = {}
+      waiting = {}
+      for each in targets:
+         host = common.normalize_host(each[1])
+         if (each[0] == "simple") and (each not in ranked) and (host in http):
+            waiting.setdefault(host, []).append(each)
+         else:
+            running[pool.submit(limited_check, each, settings, limiter)] = each
+      while running != {}:
+         outcomes = {}
+         for each in wait_futures(running, return_when=FIRST_COMPLETED)[0]:
+            probe = running.pop(each)
+            outcomes[probe] = each.result()
+            host = common.normalize_host(probe[1])
+            if (probe[0] != "advanced") or (host not in waiting):
+               continue
+            http[host] -= 1
+            if outcomes[probe]["up"]:
+               # The HTTP request time is not a ping time, so latency is left unknown
+               for each1 in waiting.pop(host):
+                  outcomes[each1] = make_outcome(True, None, 0.0)
+            elif http[host] == 0:
+               for each1 in waiting.pop(host):
+                  running[pool.submit(limited_check, each1, settings, limiter)] = each1
+         # Send outcomes back as soon as they are known, so check_main() can publish them
+         pipe.send(outcomes)
+   if session is not None:
+      session.finish()
+   pipe.send("DONE")
    pipe.close()
 
 
-def cache_gen_spawn(settings: dict, track: dict):
+def cache_gen_spawn(settings: dict, targets: list):
    """Spwan cache_gen_handler() as a seperate process, return the pipe to it"""
    pipe = mp.Pipe()
    proc = mp.Process(target=cache_gen_handler, args=(pipe[0],))
@@ -154,43 +366,199 @@ def cache_gen_spawn(settings: dict, track: dict):
    pipe = pipe[1]
    pipe.send({"SETTINGS": settings})
    if pipe.recv() == "ACCEPTED":
-      pipe.send({"TO_TRACK": track})
+      pipe.send({"TARGETS": targets})
    if pipe.recv() == "ACCEPTED":
       pipe.send("START")
-   return (pipe, proc)
+   return (pipe, proc, targets)
+
+
+def outcomes_up(outcomes: dict, previous: dict=None) -> dict:
+   """Reduce the outcome of each target to just whether it is up.
+      Targets that timed out keep their result from `previous`, if they have one.
+   """
+   if previous is None:
+      previous = {}
+   output = {}
+   for each in outcomes:
+      if outcomes[each].get("timed_out", False) and (each in previous):
+         output[each] = previous[each]
+      else:
+         output[each] = outcomes[each]["up"]
+   return output
+
+
+def sweep_spawn(settings: dict, to_track: dict, profile: str=None) -> list:
+   """Start one cache_gen_handler() per shard of probes.
+      If `profile` is set, each worker profiles it's sweep in that mode.
+   """
+   targets = build_targets(to_track)
+   if federation.enabled(settings):
+      targets = federation.assigned_targets(targets, settings)
+   targets = unique_probes(targets)
+   shards = [each for each in shard_targets(targets, settings.get("check_workers", 1)) if each != []]
+   settings = dict(settings, rate_limit=ratelimit.split(settings["rate_limit"], len(shards)))
+   if profile is not None:
+      settings["profile"] = profile
+   ranked = ranked_probes(to_track)
+   return [cache_gen_spawn(dict(settings, ranked_probes=[each1 for each1 in each if each1 in ranked]), each)
+           for each in shards]
+
+
+def catagory_probes(to_track: dict) -> dict:
+   """Get the probes each catagory depends on. Entries in misc are
+      their own catagories here, named ("misc", entry).
+   """
+   output = {}
+   for each in to_track:
+      if each != "misc":
+         output[each] = {probe_key((to_track[each]["type"], each1)) for each1 in to_track[each]["urls"]}
+      else:
+         for each1 in to_track["misc"]:
+            output[("misc", each1)] = {probe_key((to_track["misc"][each1]["type"], to_track["misc"][each1]["url"]))}
+   return output
+
+
+def tracked(to_track: dict, name) -> bool:
+   """Whether a catagory, named like catagory_probes() names them, is still in to_track"""
+   if isinstance(name, tuple):
+      return name[1] in to_track.get("misc", {})
+   return name in to_track
+
+
+def subset_track(to_track: dict, names: list) -> dict:
+   """Get the tracking info for only some catagories, named like catagory_probes() names them"""
+   output = {}
+   for each in names:
+      if isinstance(each, tuple):
+         output.setdefault("misc", {})[each[1]] = to_track["misc"][each[1]]
+      else:
+         output[each] = to_track[each]
+   return output
+
+
+def apply_update(cache: dict, update: dict, now: float) -> list:
+   """Merge newly built statuses into the cache, keeping SINCE for anything that did not change.
+      Returns a notify event for every status that changed.
+   """
+   import notify
+   events = []
+   for each in update:
+      if each != "misc":
+         if (each in cache) and (update[each]["STATUS"] == cache[each]["STATUS"]):
+            update[each]["SINCE"] = cache[each]["SINCE"]
+         else:
+            update[each]["SINCE"] = now
+            if each in cache:
+               events.append(notify.make_event(each, None, cache[each]["STATUS"], update[each]["STATUS"], now))
+         cache[each] = update[each]
+      else:
+         if "misc" not in cache:
+            cache["misc"] = {}
+         for each1 in update["misc"]:
+            old = cache["misc"].get(each1)
+            if (old is not None) and (update["misc"][each1]["STATUS"] == old["STATUS"]):
+               update["misc"][each1]["SINCE"] = old["SINCE"]
+            else:
+               update["misc"][each1]["SINCE"] = now
+               if old is not None:
+                  events.append(notify.make_event("misc", each1, old["STATUS"], update["misc"][each1]["STATUS"], now))
+            cache["misc"][each1] = update["misc"][each1]
+   return events
 
 
 def check_main(pipe) -> None:
    """This is supposed to run as a seperate thread. Do not call directly!"""
+   import notify
+   import export
+   if mp.get_start_method() == "forkserver":
+      # Probe workers are started fresh every sweep. Have this process's fork server
+      # import what they need once, so each one inherits it rather than importing it again.
+      mp.set_forkserver_preload(["check", "icmplib", "urllib3"])
    last = 0
    last_dump = 0
+   started = 0
    to_track = {}
    settings = {}
    cache = {}
-   new_cache = None
    running = False
    checking = None
+   pending = {}
+   deadline = 0
+   swept = {}
+   federating = None
+   peers = {}
+   local_results = {"time": None, "results": {}}
+   notifier = None
+   generation = 0
+   simulator = None
+   clock = time.time
+   profile = None
+   profile_workers = None
+   outcomes = {}
+   rankings = None
+   exporter = None
    while True:
       to_read = []
       to_read = pipe.has_unread(parent=False)
       pipe.load_messages(parent=False)
       if to_read == []:
          try:
-            time.sleep(round(settings["check_freq"] / 20))
+            wait = round(settings["check_freq"] / 20) / simulate.speed(settings)
          except KeyError:
-            time.sleep(3)
+            wait = 3
+         if checking:
+            # Wake up as soon as a worker has outcomes to publish
+            multiprocessing.connection.wait([each[0] for each in checking], timeout=wait)
+         else:
+            time.sleep(wait)
       else:
          for each in to_read:
             data = pipe.recv(each)
             if isinstance(data, dict):
                if "TO_TRACK" in data:
                   to_track = data["TO_TRACK"]
+                  # A sweep in progress can't publish catagories that are no longer tracked
+                  for each1 in [each1 for each1 in pending if not tracked(to_track, each1)]:
+                     del pending[each1]
                   pipe.send_response(each, "ACCEPTED")
                elif "SETTINGS" in data:
                   settings = data["SETTINGS"]
                   pipe.send_response(each, "ACCEPTED")
                elif "OBTAIN" in data:
                   pipe.send_response(each, cache[data["OBTAIN"]])
+               elif "OBTAIN_SNAPSHOT" in data:
+                  # The caller already has this generation, don't send it all again
+                  if data["OBTAIN_SNAPSHOT"] == generation:
+                     pipe.send_response(each, "UNCHANGED")
+                  else:
+                     pipe.send_response(each, {"GENERATION": generation, "TIME": last, "CACHE": cache,
+                                               "POOLS": rankings.pools if rankings is not None else {}})
+               elif "PROFILE" in data:
+                  request = data["PROFILE"]
+                  problem = None
+                  try:
+                     seconds = profiling.clamp_seconds(request["seconds"], settings["profiling"])
+                  except ValueError as error:
+                     problem = str(error)
+                  if problem is not None:
+                     pipe.send_response(each, problem)
+                  elif request["mode"] not in profiling.MODES:
+                     pipe.send_response(each, f"UNKNOWN PROFILE MODE: {request['mode']}")
+                  elif request["target"] == "checker":
+                     if profile is not None:
+                        pipe.send_response(each, "ALREADY PROFILING")
+                     else:
+                        profile = profiling.Session("checker", request["mode"], seconds, settings["profiling"])
+                        pipe.send_response(each, {"ACCEPTED": profile.path})
+                  elif request["target"] == "workers":
+                     # Probes run in a thread pool, which cProfile can't see into
+                     if request["mode"] != "sample":
+                        pipe.send_response(each, f"ONLY SAMPLE MODE CAN BE USED ON WORKERS, NOT: {request['mode']}")
+                     else:
+                        profile_workers = {"mode": request["mode"], "until": time.time() + seconds}
+                        pipe.send_response(each, {"ACCEPTED": settings["profiling"]["directory"]})
+                  else:
+                     pipe.send_response(each, f"UNKNOWN PROFILE TARGET: {request['target']}")
             elif isinstance(data, str):
                if data.upper() == "START":
                   if running:
@@ -202,6 +570,13 @@ def check_main(pipe) -> None:
                         pipe.send_response(each, "CAN NOT START: NO TRACKING INFO")
                      else:
                         running = True
+                        rankings = pools.Rankings(settings["pools"])
+                        if export.enabled(settings):
+                           exporter = export.Exporter(settings["export"])
+                        simulator = simulate.make_simulator(settings)
+                        clock = simulate.make_clock(settings, simulator)
+                        if notify.enabled(settings):
+                           notifier = notify.notify_spawn(settings)
                         if settings["cache_to_disk"]:
                            if os.path.exists("cache.json"):
                               with open("cache.json", "r") as file:
@@ -211,8 +586,17 @@ def check_main(pipe) -> None:
                   print("SHUTTING DOWN!")
                   pipe.close(parent=False)
                   if checking is not None:
-                     checking[0].close()
-                     checking[1].join(timeout=5)
+                     for each1 in checking:
+                        each1[0].close()
+                        each1[1].join(timeout=5)
+                  if federating is not None:
+                     federating[0].close()
+                     federating[1].join(timeout=5)
+                  if profile is not None:
+                     profile.finish()
+                  if notifier is not None:
+                     notifier[0].put("SHUTDOWN")
+                     notifier[1].join(timeout=settings["notify"]["timeout"] + 5)
                   if settings["cache_to_disk"]:
                      with open("cache.json", "w") as file:
                         json.dump(cache, file, indent=2)
@@ -221,54 +605,154 @@ def check_main(pipe) -> None:
                   pipe.send_response(each, cache)
                elif data.upper() == "OBTAIN_CATAGORIES":
                   pipe.send_response(each, tuple(cache.keys()))
+               elif data.upper() == "OBTAIN_SNAPSHOT":
+                  pipe.send_response(each, {"GENERATION": generation, "TIME": last, "CACHE": cache,
+                                            "POOLS": rankings.pools if rankings is not None else {}})
+               elif data.upper() == "OBTAIN_RESULTS":
+                  node_id = None
+                  if "federation" in settings:
+                     node_id = settings["federation"]["node_id"]
+                  pipe.send_response(each, {"node": node_id,
+                                            "time": local_results["time"],
+                                            "results": federation.encode_results(local_results["results"])})
+
+         # Everything read has been answered, stop sending it back and forth
+         for each in to_read:
+            pipe.forget(each)
 
       ### END OF COMMAND HANDLING
 
+      if profile is not None:
+         if profile.expired():
+            profile.finish()
+            profile = None
+      if profile_workers is not None:
+         if time.time() >= profile_workers["until"]:
+            profile_workers = None
+
       if "check_freq" in settings:
-         if (last + settings["check_freq"]) <= time.time():
+         if ((last + settings["check_freq"]) <= clock()) and simulate.due(clock):
             if running:
                if checking is None:
-                  checking = cache_gen_spawn(settings, to_track)
+                  outcomes = {}
+                  swept = {}
+                  started = clock()
+                  rankings.start_sweep()
+                  deadline = time.time() + settings.get("sweep_deadline", settings["check_freq"])
+                  if simulator is not None:
+                     # Nothing to check, the outcomes are already known
+                     checking = []
+                     outcomes = simulate.sweep(simulator, unique_probes(build_targets(to_track)), started)
+                     sent = set(outcomes)
+                  else:
+                     if profile_workers is not None:
+                        checking = sweep_spawn(settings, to_track, profile_workers["mode"])
+                     else:
+                        checking = sweep_spawn(settings, to_track)
+                     sent = {each1 for each in checking for each1 in each[2]}
+                  # Only wait for probes this node actually sends
+                  pending = catagory_probes(to_track)
+                  pending = {each: pending[each] & sent for each in pending}
+                  if federation.enabled(settings):
+                     federating = federation.peer_fetch_spawn(settings)
                else:
-                  if checking[0].poll():
+                  # Take in outcomes from each shard as they come in
+                  for each in list(checking):
                      try:
-                        new_cache = checking[0].recv()
+                        while each[0].poll():
+                           data = each[0].recv()
+                           if data == "DONE":
+                              each[1].join(timeout=5)
+                              checking.remove(each)
+                              break
+                           outcomes.update(data)
                      except EOFError:
-                        continue
+                        # Worker died, which says nothing about the probes it did not get to
+                        outcomes.update({each1: timed_out_outcome() for each1 in each[2] if each1 not in outcomes})
+                        each[1].join(timeout=5)
+                        checking.remove(each)
+                  if federating is not None:
+                     if federating[0].poll():
+                        try:
+                           peers = federating[0].recv()
+                        except EOFError:
+                           peers = {}
+                        federating[1].join(timeout=5)
+                        federating = None
+                  if time.time() >= deadline:
+                     # Out of time, don't let stragglers hold up everything else any longer
+                     for each in checking:
+                        late = [each1 for each1 in each[2] if each1 not in outcomes]
+                        print(f"SWEEP DEADLINE PASSED: {len(late)} PROBE(S) TIMED OUT")
+                        each[1].terminate()
+                        each[1].join(timeout=5)
+                        each[0].close()
+                        outcomes.update({each1: timed_out_outcome() for each1 in late})
+                     checking = []
+                     if federating is not None:
+                        # Keep using the peer results from last time
+                        federating[1].terminate()
+                        federating[1].join(timeout=5)
+                        federating[0].close()
+                        federating = None
+
+                  # Publish every catagory that has all of it's outcomes
+                  if federating is None:
+                     ready = [each for each in pending if pending[each].issubset(outcomes)]
+                     if ready != []:
+                        update = subset_track(to_track, ready)
+                        targets = build_targets(update)
+                        update_outcomes = fan_out(targets, outcomes)
+                        results = outcomes_up(update_outcomes, cached_results(cache, update))
+                        if federation.enabled(settings):
+                           results = federation.vote(targets, results, peers, settings)
+                        swept.update(results)
+                        timed_out = {each for each in update_outcomes if update_outcomes[each].get("timed_out", False)}
+                        for each in apply_update(cache, build_cache(update, results, timed_out), clock()):
+                           if notifier is not None:
+                              notifier[0].put(each)
+                        # Only the pools that just came in need sorting and writing out again
+                        rankings.update(update, update_outcomes, swept)
+                        for each in ready:
+                           del pending[each]
+                        generation += 1
+                        if exporter is not None:
+                           try:
+                              exporter.export_catagories(cache, rankings.pools, list(update))
+                           except OSError as error:
+                              print(f"EXPORT FAILED: {error}")
+
+                  if (checking == []) and (federating is None) and (pending == {}):
+                     local_results = {"time": time.time(),
+                                      "results": outcomes_up(fan_out(build_targets(to_track), outcomes),
+                                                             local_results["results"])}
+                     # Drop anything that is no longer tracked
+                     for each in [each for each in cache if each not in to_track]:
+                        del cache[each]
+                     if "misc" in cache:
+                        for each in [each for each in cache["misc"] if each not in to_track["misc"]]:
+                           del cache["misc"][each]
+                     rankings.prune(to_track)
+                     if simulate.mode(settings) == "record":
+                        # Every probe this sweep, timed out or not, even if it's worker was killed
+                        simulate.record(settings["simulation"]["trace"], started, outcomes)
+                     if exporter is not None:
+                        try:
+                           exporter.export(cache, rankings.pools)
+                        except OSError as error:
+                           print(f"EXPORT FAILED: {error}")
                      checking = None
-                     last = time.time()
-
-      if new_cache is not None:
-         if cache != {}:
-            for each in new_cache:
-               if each != "misc":
-                  if new_cache[each]["STATUS"] == cache[each]["STATUS"]:
-                     new_cache[each]["SINCE"] = cache[each]["SINCE"]
-                  else:
-                     new_cache[each]["SINCE"] = time.time()
-               else:
-                  for each1 in new_cache["misc"]:
-                     if new_cache["misc"][each1]["STATUS"] == cache["misc"][each1]["STATUS"]:
-                        new_cache["misc"][each1]["SINCE"] = cache["misc"][each1]["SINCE"]
-                     else:
-                        new_cache["misc"][each1]["SINCE"] = time.time()
-         else:
-            for each in new_cache:
-               if each != "misc":
-                  new_cache[each]["SINCE"] = time.time()
-               else:
-                  for each1 in new_cache["misc"]:
-                     new_cache["misc"][each1]["SINCE"] = time.time()
-         cache = copy.deepcopy(new_cache)
-         new_cache = None
-
-         if "check_freq" in settings:
-            if "cache_to_disk" in settings:
-               if settings["cache_to_disk"]:
-                  if time.time() >= ((settings["check_freq"] * 3) + last_dump):
-                     with open("cache.json", "w") as file:
-                        json.dump(cache, file, indent=2)
-                     last_dump = time.time()
+                     last = clock()
+                     simulate.tick(clock, settings["check_freq"])
+                     # Pruning and TIME changed the snapshot too
+                     generation += 1
+
+                     if "cache_to_disk" in settings:
+                        if settings["cache_to_disk"]:
+                           if time.time() >= ((settings["check_freq"] * 3) + last_dump):
+                              with open("cache.json", "w") as file:
+                                 json.dump(cache, file, indent=2)
+                              last_dump = time.time()
 
 
 class UptimeChecker():
@@ -283,10 +767,23 @@ class UptimeChecker():
       while not self.proc.is_alive():
          time.sleep(1)
 
+   def __getstate__(self) -> dict:
+      """Only the pipe is shared with other processes. The process handle stays with the parent."""
+      return {"pipe": self.pipe}
+
+   def __setstate__(self, state: dict) -> None:
+      """Rebuild in another process"""
+      self.pipe = state["pipe"]
+      self.proc = None
+
    def send(self, data: any) -> str:
       """Send data to child process"""
       return self.pipe.send(data)
 
+   def forget(self, key: str) -> None:
+      """Drop a message, once it's response has been received"""
+      self.pipe.forget(key)
+
    def recv(self, key: str, block=True, timeout=None) -> any:
       """Send data to child process"""
       self.pipe.load_messages()
@@ -22,6 +22,10 @@
 #
 #
 """Common Functions for Hermes"""
+import sys
+import bisect
+import hashlib
+
 G = "\033[92m"
 R = "\033[91m"
 NC = "\033[0m"
@@ -47,3 +51,64 @@ def unique(starting_list):
             # unique_list.append(each)
     # return unique_list
     return list(set(starting_list))
+
+
+def host_of(url: str) -> str:
+    """Get just the host name out of a URL"""
+    if "://" in url:
+        url = url.split("://", 1)[1]
+    return url.split("/", 1)[0]
+
+
+def normalize_host(url: str) -> str:
+    """Get the host name out of a URL in a form that can be compared:
+       lower case, with no port and no trailing dot
+    """
+    host = host_of(url).lower()
+    if host.startswith("["):
+        # IPv6 address, possibly with a port after it
+        return host[1:].split("]", 1)[0]
+    if host.count(":") == 1:
+        host = host.split(":", 1)[0]
+    return host.rstrip(".")
+
+
+def normalize_url(url: str) -> str:
+    """Get a URL in a form that can be compared: scheme and host in lower case, no trailing slash"""
+    scheme = ""
+    if "://" in url:
+        scheme, url = url.split("://", 1)
+        scheme = scheme.lower() + "://"
+    host = url.split("/", 1)[0]
+    path = url[len(host):].rstrip("/")
+    return scheme + host.lower().rstrip(".") + path
+
+
+def stable_hash(key: str) -> int:
+    """Hash a string the same way in every process (unlike hash())"""
+    return int.from_bytes(hashlib.md5(key.encode()).digest()[:8], "big")
+
+
+def hash_ring(names: list, replicas: int=64) -> list:
+    """Build a consistent hashing ring from a list of names.
+       Each name gets `replicas` points on the ring to even out the distribution.
+    """
+    ring = []
+    for each in names:
+        for each1 in range(replicas):
+            ring.append((stable_hash(f"{each}#{each1}"), each))
+    ring.sort()
+    return ring
+
+
+def ring_lookup(ring: list, key: str, count: int=1) -> list:
+    """Get the first `count` distinct names on the ring at or after `key`"""
+    output = []
+    start = bisect.bisect(ring, (stable_hash(key),))
+    for each in range(len(ring)):
+        name = ring[(start + each) % len(ring)][1]
+        if name not in output:
+            output.append(name)
+            if len(output) >= count:
+                break
+    return output
@@ -64,7 +64,7 @@ class Duplex():
         self.key_len = key_len
         self.parent_to_child = mp.Queue()
         self.child_to_parent = mp.Queue()
-        self.responded = []
+        self.responded = set()
 
         self.log = {}
 
@@ -95,9 +95,9 @@ class Duplex():
             add["from_parent"] = False
         self.log[key] = add
         if parent:
-            self.parent_to_child.put(self.log)
+            self.parent_to_child.put(dict(self.log))
         else:
-            self.child_to_parent.put(self.log)
+            self.child_to_parent.put(dict(self.log))
         return key
 
     def send_response(self, key: str, message: any) -> bool:
@@ -114,27 +114,42 @@ class Duplex():
         update["timestamps"]["modified"] = time.time()
         self.log.update({key: update})
         if add["from_parent"]:
-            self.parent_to_child.put(self.log)
+            self.parent_to_child.put(dict(self.log))
         else:
-            self.child_to_parent.put(self.log)
+            self.child_to_parent.put(dict(self.log))
 
-    def load_messages(self, parent=True) -> None:
+    def load_messages(self, parent=True) -> bool:
         """Load new messages from queues into log
            Returns True if new messages available, False otherwise.
         """
+        loaded = None
         if not parent:
             while not self.parent_to_child.empty():
-                self.log.update(self.parent_to_child.get_nowait())
+                loaded = self.parent_to_child.get_nowait()
+                self.log.update(loaded)
         else:
             while not self.child_to_parent.empty():
-                self.log.update(self.child_to_parent.get_nowait())
+                loaded = self.child_to_parent.get_nowait()
+                self.log.update(loaded)
+        if loaded is None:
+            return False
+        # Messages the other side no longer sends can't be sent again, so stop remembering them
+        self.responded &= set(loaded)
+        return True
+
+    def forget(self, key: str) -> None:
+        """Drop a message that has been dealt with from the log.
+           The whole log is sent with every message, so otherwise it would only ever grow.
+           Queues pickle in the background, which is why they are given a copy of the log.
+        """
+        self.log.pop(key, None)
 
 
     def recv(self, key: str) -> any:
         """Receive a message from other process"""
         self.log[key]["read"] = True
         self.log[key]["timestamps"]["accessed"] = time.time()
-        self.responded.append(key)
+        self.responded.add(key)
         return self.log[key]["message"]
 
     def get_timestamps(self, key: str) -> float:
@@ -156,6 +171,9 @@ class Duplex():
         """Check for unread messages"""
         keys = []
         for each in self.log:
+            # Already answered, and then forgotten, but sent back by the other side since
+            if each in self.responded:
+                continue
             if (parent ^ self.log[each]["from_parent"]):
                 if not self.log[each]["read"]:
                     if self.log[each]['response'] is None:
@@ -0,0 +1,159 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+#
+#  export.py
+#
+#  Copyright 2025 Thomas Castleman <batcastle@draugeros.org>
+#
+#  This program is free software; you can redistribute it and/or modify
+#  it under the terms of the GNU General Public License as published by
+#  the Free Software Foundation; either version 2 of the License, or
+#  (at your option) any later version.
+#
+#  This program is distributed in the hope that it will be useful,
+#  but WITHOUT ANY WARRANTY; without even the implied warranty of
+#  MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+#  GNU General Public License for more details.
+#
+#  You should have received a copy of the GNU General Public License
+#  along with this program; if not, write to the Free Software
+#  Foundation, Inc., 51 Franklin Street, Fifth Floor, Boston,
+#  MA 02110-1301, USA.
+#
+#
+"""Write statuses out as static files, so NGINX can serve them without touching Python
+
+   check_main() writes:
+    - catagories/<catagory>.json: one catagory, like /catagories/<catagory>
+    - pools/<pool>.json: the ranking of a pool, like /pools/<pool>/best with no limit
+    - status.json: every catagory, like / status with no filters
+    - index.html: a minimal status page (optional)
+   The files of a catagory and it's pool are written as soon as it's checks are in,
+   status.json and index.html once the whole sweep is done.
+   Every file is written to a temporary file first and then renamed into place,
+   so NGINX never serves a half written file. Files that have not changed are not rewritten,
+   and files for catagories and pools that are no longer tracked are deleted.
+
+   Settings (under "export" in settings.json):
+    - enabled: turn exporting on or off
+    - directory: where to write the files
+    - html: whether to write index.html
+"""
+import tempfile
+import html
+import json
+import os
+import notify
+
+
+def enabled(settings: dict) -> bool:
+    """Check if exporting is turned on"""
+    if "export" not in settings:
+        return False
+    return settings["export"]["enabled"]
+
+
+def file_name(name: str) -> str:
+    """Make a catagory or pool name safe to use as a file name"""
+    return name.replace("/", "_").lstrip(".")
+
+
+def write_atomic(path: str, data: bytes) -> None:
+    """Write a file so that readers only ever see the old or the new contents"""
+    directory = os.path.dirname(path)
+    os.makedirs(directory, exist_ok=True)
+    handle, temp = tempfile.mkstemp(dir=directory, prefix=".tmp-")
+    try:
+        with os.fdopen(handle, "wb") as file:
+            file.write(data)
+        # mkstemp() makes files only we can read, NGINX needs to read them too
+        os.chmod(temp, 0o644)
+        os.replace(temp, path)
+    except BaseException:
+        os.remove(temp)
+        raise
+
+
+def render_html(cache: dict) -> str:
+    """Render a minimal status page"""
+    rows = []
+    for each in cache:
+        if each == "misc":
+            for each1 in cache["misc"]:
+                rows.append((f"misc/{each1}", notify.status_text(cache["misc"][each1]["STATUS"])))
+        else:
+            rows.append((each, notify.status_text(cache[each]["STATUS"])))
+    body = "\n".join([f"<tr><td>{html.escape(each[0])}</td><td>{html.escape(each[1])}</td></tr>" for each in rows])
+    return f"""<!DOCTYPE html>
+<html>
+<head><meta charset="utf-8"><title>Hermes Status</title></head>
+<body>
+<h1>Hermes Status</h1>
+<table>
+<tr><th>Service</th><th>Status</th></tr>
+{body}
+</table>
+</body>
+</html>
+"""
+
+
+def render_files(cache: dict, pools: dict, names: list) -> dict:
+    """Render the files of some catagories and their pools, by file name"""
+    files = {}
+    for each in names:
+        if each in cache:
+            files[f"catagories/{file_name(each)}.json"] = json.dumps({"output": cache[each],
+                                                                      "return_status": 200}).encode()
+        if each in pools:
+            files[f"pools/{file_name(each)}.json"] = json.dumps({"output": pools[each],
+                                                                 "return_status": 200}).encode()
+    return files
+
+
+class Exporter():
+    """Write out static files as sweeps come in"""
+    def __init__(self, settings: dict):
+        """Initalization"""
+        self.directory = settings["directory"]
+        self.html = settings["html"]
+        self.written = {}
+
+    def write(self, name: str, data: bytes) -> bool:
+        """Write a file if it changed since last time. Returns True if it was written."""
+        if self.written.get(name) == data:
+            return False
+        write_atomic(os.path.join(self.directory, name), data)
+        self.written[name] = data
+        return True
+
+    def remove(self, name: str) -> None:
+        """Delete a file that was written before"""
+        try:
+            os.remove(os.path.join(self.directory, name))
+        except FileNotFoundError:
+            pass
+        del self.written[name]
+
+    def export_catagories(self, cache: dict, pools: dict, names: list) -> int:
+        """Write out the files of only some catagories and their pools. Returns how many had to be written."""
+        count = 0
+        files = render_files(cache, pools, names)
+        for each in files:
+            count += self.write(each, files[each])
+        return count
+
+    def export(self, cache: dict, pools: dict) -> int:
+        """Write out every file, and delete those for catagories and pools that are gone.
+           Returns how many had to be written.
+        """
+        files = {"status.json": json.dumps({"output": cache, "return_status": 200}).encode()}
+        files.update(render_files(cache, pools, set(cache) | set(pools)))
+        if self.html:
+            files["index.html"] = render_html(cache).encode()
+        count = 0
+        for each in files:
+            count += self.write(each, files[each])
+        for each in [each1 for each1 in self.written if each1 not in files]:
+            self.remove(each)
+        return count
@@ -0,0 +1,149 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+#
+#  federation.py
+#
+#  Copyright 2025 Thomas Castleman <batcastle@draugeros.org>
+#
+#  This program is free software; you can redistribute it and/or modify
+#  it under the terms of the GNU General Public License as published by
+#  the Free Software Foundation; either version 2 of the License, or
+#  (at your option) any later version.
+#
+#  This program is distributed in the hope that it will be useful,
+#  but WITHOUT ANY WARRANTY; without even the implied warranty of
+#  MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+#  GNU General Public License for more details.
+#
+#  You should have received a copy of the GNU General Public License
+#  along with this program; if not, write to the Free Software
+#  Foundation, Inc., 51 Franklin Street, Fifth Floor, Boston,
+#  MA 02110-1301, USA.
+#
+#
+"""Share check results between several Hermes nodes
+
+   Each node serves the results of it's own checks at /federation/results,
+   and pulls the results of it's peers every sweep. The final result for
+   each target is then decided by a quorum vote across every node that
+   has a recent result for it. This stops a problem with one node's network
+   path from being reported as the service itself being down.
+
+   Settings (under "federation" in settings.json):
+    - enabled: turn federation on or off
+    - node_id: the name of this node. Must be unique among it's peers
+    - peers: mapping of peer node_id to the base URL of it's API
+    - replicas: how many nodes check each target. 0 means every node checks everything
+    - quorum: how many nodes must see a target as down for it to be down. 0 means a majority
+    - max_age: ignore peer results older than this many seconds
+    - timeout: seconds to wait for each peer to respond
+"""
+import multiprocessing as mp
+import time
+import json
+import common
+
+
+def enabled(settings: dict) -> bool:
+    """Check if federation is turned on"""
+    if "federation" not in settings:
+        return False
+    return settings["federation"]["enabled"]
+
+
+def target_key(target: tuple) -> str:
+    """Turn a (type, url) target into a string, for sending as JSON"""
+    return f"{target[0]}:{target[1]}"
+
+
+def encode_results(results: dict) -> dict:
+    """Make results from check.cache_gen_handler() JSON safe"""
+    return {target_key(each): results[each] for each in results}
+
+
+def decode_results(results: dict) -> dict:
+    """Undo encode_results()"""
+    return {tuple(each.split(":", 1)): results[each] for each in results}
+
+
+def assigned_targets(targets: list, settings: dict) -> list:
+    """Get the targets this node is responsible for checking.
+       With replicas set, each target is checked by that many nodes, picked
+       by consistent hashing, instead of by every node.
+    """
+    fed = settings["federation"]
+    nodes = [fed["node_id"]] + list(fed["peers"].keys())
+    if fed["replicas"] <= 0 or fed["replicas"] >= len(nodes):
+        return targets
+    ring = common.hash_ring(nodes)
+    return [each for each in targets
+            if fed["node_id"] in common.ring_lookup(ring, target_key(each), fed["replicas"])]
+
+
+def vote(targets: list, local: dict, peers: dict, settings: dict) -> dict:
+    """Decide the result for each target from local and peer results.
+       A target is down only if at least `quorum` nodes with a recent result say so.
+       Targets no node has a result for are counted as down.
+    """
+    fed = settings["federation"]
+    oldest = time.time() - fed["max_age"]
+    fresh = [peers[each]["results"] for each in peers if peers[each]["time"] >= oldest]
+    output = {}
+    for each in targets:
+        votes = []
+        if each in local:
+            votes.append(local[each])
+        for each1 in fresh:
+            if each in each1:
+                votes.append(each1[each])
+        if votes == []:
+            output[each] = False
+            continue
+        quorum = fed["quorum"]
+        if quorum <= 0:
+            quorum = (len(votes) // 2) + 1
+        quorum = min(quorum, len(votes))
+        output[each] = votes.count(False) < quorum
+    return output
+
+
+def peer_fetch_handler(pipe) -> None:
+    """Pull the latest results from every peer"""
+    import urllib3 as url3
+    settings = {}
+    while True:
+        data = pipe.recv()
+        if "SETTINGS" in data:
+            settings = data["SETTINGS"]
+            pipe.send("ACCEPTED")
+        elif data == "START":
+            break
+    fed = settings["federation"]
+    http = url3.PoolManager(timeout=fed["timeout"], retries=False)
+    peers = {}
+    for each in fed["peers"]:
+        url = fed["peers"][each]
+        if url[-1] == "/":
+            url = url[:-1]
+        try:
+            data = http.request("GET", f"{url}/federation/results")
+            data = json.loads(data.data.decode())["output"]
+        except (url3.exceptions.HTTPError, json.decoder.JSONDecodeError, KeyError, TypeError):
+            continue
+        if data["time"] is None:
+            continue
+        peers[each] = {"time": data["time"], "results": decode_results(data["results"])}
+    pipe.send(peers)
+    pipe.close()
+
+
+def peer_fetch_spawn(settings: dict):
+    """Spawn peer_fetch_handler() as a seperate process, return the pipe to it"""
+    pipe = mp.Pipe()
+    proc = mp.Process(target=peer_fetch_handler, args=(pipe[0],))
+    proc.start()
+    pipe = pipe[1]
+    pipe.send({"SETTINGS": settings})
+    if pipe.recv() == "ACCEPTED":
+        pipe.send("START")
+    return (pipe, proc)
@@ -27,46 +27,57 @@ import time
 import multiprocessing as mp
 import sys
 import os
+import common
 import check
-import hermes_api as api
-import loading_api_response as lar
+import simulate
 
+# Each process started from here only imports what its role needs: the checker
+# never loads Flask, and the API servers never load icmplib or urllib3.
+# So hermes_api and loading_api_response are only imported by their runners.
 
-def flask_runner(argv, pipe):
+
+def flask_runner(argv, pipe, port: int, cache_ttl: float, profiling_settings: dict):
     """Give Hermes API it's own process"""
-    api.init(argv, pipe)
+    import hermes_api as api
+    api.init(argv, pipe, cache_ttl, profiling_settings)
     if api.MODE:
-        api.HERMES.run(host="0.0.0.0", debug=api.MODE)
+        api.HERMES.run(host="0.0.0.0", debug=api.MODE, port=port)
     else:
-        api.HERMES.run()
+        api.HERMES.run(port=port)
 
 
-def loading_flask_runner(mode: bool):
+def loading_flask_runner(mode: bool, port: int):
     """Give Hermes API it's own process"""
+    import loading_api_response as lar
     if mode:
-        lar.HERMES.run(host="0.0.0.0", debug=mode)
+        lar.HERMES.run(host="0.0.0.0", debug=mode, port=port)
     else:
-        lar.HERMES.run()
+        lar.HERMES.run(port=port)
 
 
 def main():
     """main() for Hermes. This mostly just coordinates everything."""
     # Check if running as root as ping3 requires it.
     if os.geteuid() != 0:
-        eprint("Please run this script as root!")
+        common.eprint("Please run this script as root!")
         sys.exit(1)
     with open("track.json", "r") as file:
         to_track = json.load(file)
     with open("settings.json", "r") as file:
         settings = json.load(file)
+    if simulate.mode(settings) == "synthetic":
+        to_track = simulate.synthetic_track(settings)
+    # Children are started from a clean interpreter (spawn) or a small fork server
+    # (forkserver) rather than a copy of this process.
+    mp.set_start_method(settings.get("start_method", "forkserver"))
     check_proc = check.UptimeChecker(settings["key_len"])
     # time.sleep(0.001)
 
     proc = None
     if ("--debug" in sys.argv) or ("-debug" in sys.argv) or ("-d" in sys.argv):
-        proc = mp.Process(target=loading_flask_runner, args=(True,))
+        proc = mp.Process(target=loading_flask_runner, args=(True, settings.get("api_port", 5000)))
     else:
-        proc = p.Process(target=loading_flask_runner, args=(False,))
+        proc = mp.Process(target=loading_flask_runner, args=(False, settings.get("api_port", 5000)))
     proc.start()
 
 
@@ -107,7 +118,8 @@ def main():
         time.sleep(0.5)
     time.sleep(5)
     print("STARTING FLASK!")
-    proc = mp.Process(target=flask_runner, args=(sys.argv, check_proc))
+    proc = mp.Process(target=flask_runner, args=(sys.argv, check_proc, settings.get("api_port", 5000),
+                                                 settings.get("api_cache_ttl", 1.0), settings.get("profiling")))
     proc.start()
 
     # # Check it works
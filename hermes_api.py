@@ -23,18 +23,129 @@
 #
 """Provide REST API to retreive statuses"""
 from flask import Flask, request, redirect, render_template, send_from_directory, url_for
+import threading
+import time
+import hmac
+import math
+import profiling
 
 HERMES = Flask(__name__)
 MODE = False
 PIPE = None
+# comms.Duplex is not thread safe, so only one request thread may use PIPE at a time
+PIPE_LOCK = threading.Lock()
+# How long a snapshot of the cache is reused for before asking check_main() again
+CACHE_TTL = 1.0
+SNAPSHOT = {"GENERATION": None, "TIME": None, "CACHE": {}, "POOLS": {}, "FETCHED": 0}
+# Responses built from the current snapshot, cleared whenever a new sweep comes in
+VIEWS = {}
+# Most responses kept in VIEWS at once, however many different filters are asked for
+MAX_VIEWS = 256
+# Held while a thread refreshes SNAPSHOT, so the rest can keep serving the old one
+REFRESHING = threading.Lock()
+FLIGHTS = {}
+FLIGHTS_LOCK = threading.Lock()
+PROFILING = None
 
 
-def init(argv, pipe):
+def init(argv, pipe, cache_ttl: float=1.0, profiling_settings: dict=None):
     global MODE
     global PIPE
+    global CACHE_TTL
+    global PROFILING
     if ("--debug" in argv) or ("-debug" in argv) or ("-d" in argv):
         MODE = True
     PIPE = pipe
+    CACHE_TTL = cache_ttl
+    PROFILING = profiling_settings
+
+
+def single_flight(key, function) -> any:
+    """Call function(), unless another thread is already calling it under the same key.
+       In which case, wait for and share that thread's result instead.
+    """
+    with FLIGHTS_LOCK:
+        flight = FLIGHTS.get(key)
+        leader = flight is None
+        if leader:
+            flight = {"done": threading.Event(), "result": None, "error": None}
+            FLIGHTS[key] = flight
+    if not leader:
+        flight["done"].wait()
+        if flight["error"] is not None:
+            raise flight["error"]
+        return flight["result"]
+    try:
+        flight["result"] = function()
+    except Exception as error:
+        flight["error"] = error
+        raise
+    finally:
+        with FLIGHTS_LOCK:
+            del FLIGHTS[key]
+        flight["done"].set()
+    return flight["result"]
+
+
+def ask(message: any) -> any:
+    """Send a message to check_main() and wait for the response"""
+    global PIPE
+    with PIPE_LOCK:
+        key = PIPE.send(message)
+        output = PIPE.recv(key)
+        PIPE.forget(key)
+        return output
+
+
+def fetch_snapshot() -> dict:
+    """Get a new snapshot of the cache from check_main(), unless it has not changed"""
+    global SNAPSHOT
+    data = ask({"OBTAIN_SNAPSHOT": SNAPSHOT["GENERATION"]})
+    if data == "UNCHANGED":
+        SNAPSHOT["FETCHED"] = time.time()
+        return SNAPSHOT
+    data["FETCHED"] = time.time()
+    VIEWS.clear()
+    SNAPSHOT = data
+    return data
+
+
+def refresh_snapshot() -> None:
+    """Fetch a new snapshot in the background"""
+    try:
+        fetch_snapshot()
+    except Exception as error:
+        print(f"SNAPSHOT REFRESH FAILED: {error}")
+    finally:
+        REFRESHING.release()
+
+
+def snapshot() -> dict:
+    """Get the latest snapshot of the cache.
+       check_main() is asked at most once per CACHE_TTL seconds, in the background.
+       Until it answers, requests are served from the snapshot already held.
+    """
+    if time.time() < (SNAPSHOT["FETCHED"] + CACHE_TTL):
+        return SNAPSHOT
+    if SNAPSHOT["GENERATION"] is None:
+        # Nothing to serve in the mean time, so wait for the first one
+        return single_flight("SNAPSHOT", fetch_snapshot)
+    if REFRESHING.acquire(blocking=False):
+        threading.Thread(target=refresh_snapshot, daemon=True).start()
+    return SNAPSHOT
+
+
+def view(key, function) -> any:
+    """Build a response from the current snapshot, or reuse it if it was already built for this sweep"""
+    data = snapshot()
+    key = (data["GENERATION"], key)
+    output = VIEWS.get(key)
+    if output is None:
+        output = function(data["CACHE"])
+        if len(VIEWS) < MAX_VIEWS:
+            VIEWS[key] = output
+    return output
+
 
 @HERMES.errorhandler(404)
 def error_404(e):
@@ -91,9 +202,7 @@ def internal_error():
 @HERMES.route("/")
 def root() -> dict:
     """Root directory"""
-    global PIPE
-    key = PIPE.send("OBTAIN_FULL_CACHE")
-    possible_nodes = PIPE.recv(key)
+    possible_nodes = snapshot()["CACHE"]
     print("RETREIVED POSSIBLE NODES!")
     output = {"return_status": 200,
               "NEXT": f"{request.url_root[:-1]}{url_for("catagories")}"}
@@ -102,10 +211,8 @@ def root() -> dict:
 
 @HERMES.route("/catagories")
 def catagories() -> dict:
-    global PIPE
-    key = PIPE.send("OBTAIN_CATAGORIES")
     output = {"return_status": 200, "output":{}}
-    possible_nodes = PIPE.recv(key)
+    possible_nodes = tuple(snapshot()["CACHE"].keys())
     for each in possible_nodes:
         output["output"][each] = f"{request.url_root[:-1]}{url_for("catagories")}/{each}"
     return output
@@ -113,12 +220,146 @@ def catagories() -> dict:
 
 @HERMES.route("/catagories/<catagory>")
 def get_node(catagory: str) -> dict:
-    global PIPE
-    key = PIPE.send("OBTAIN_CATAGORIES")
-    possible_nodes = PIPE.recv(key)
+    possible_nodes = snapshot()["CACHE"]
     if catagory not in possible_nodes:
-        redirect("/404", 404)
-    key = PIPE.send({"OBTAIN": catagory})
-    output = {"output": PIPE.recv(key)}
+        return page_not_found()
+    output = {"output": possible_nodes[catagory]}
+    output["return_status"] = 200
+    return output
+
+
+@HERMES.route("/pools")
+def pool_list() -> dict:
+    """Every pool that can be ranked"""
+    output = {"return_status": 200, "output": {}}
+    for each in snapshot()["POOLS"]:
+        output["output"][each] = f"{request.url_root[:-1]}{url_for("pool_list")}/{each}/best"
+    return output
+
+
+@HERMES.route("/pools/<pool>/best")
+def best_in_pool(pool: str) -> dict:
+    """The `n` (default 1) fastest healthy members of a pool, best first.
+       Rankings are worked out as the checks of each pool come in, so this only has to slice a list.
+    """
+    rankings = snapshot()["POOLS"]
+    if pool not in rankings:
+        return page_not_found()
+    try:
+        count = int(request.args.get("n", 1))
+    except ValueError:
+        return {"return_status": 400, "MESSAGE": "N MUST BE A NUMBER"}
+    output = {"output": rankings[pool][:max(count, 0)]}
+    output["return_status"] = 200
+    return output
+
+
+def split_arg(name: str) -> list:
+    """Get a comma separated query argument as a list, or None if not given"""
+    data = request.args.get(name)
+    if data is None:
+        return None
+    return [each.strip() for each in data.split(",") if each.strip() != ""]
+
+
+def status_state(status) -> str:
+    """Get a STATUS value as a lower-case state, for filtering on"""
+    if isinstance(status, list):
+        return "single down"
+    if isinstance(status, bool):
+        if status:
+            return "up"
+        return "down"
+    return status.lower()
+
+
+def none_or_tuple(data: list) -> tuple:
+    """Make a parsed query argument hashable, to key VIEWS on"""
+    if data is None:
+        return None
+    return tuple(data)
+
+
+def pick_fields(data: dict, fields: list) -> dict:
+    """Only keep the requested fields of a status entry"""
+    if fields is None:
+        return data
+    return {each: data[each] for each in fields if each in data}
+
+
+@HERMES.route("/status")
+def status() -> dict:
+    """Statuses of many catagories at once, from a single read of the cache.
+       Query arguments, all optional and comma separated:
+        - categories: only these catagories
+        - fields: only these fields of each entry (e.g. STATUS,SINCE)
+        - state: only entries in these states (e.g. down,degraded)
+       Entries in `misc` are filtered individually.
+    """
+    catagories = split_arg("categories")
+    fields = split_arg("fields")
+    states = split_arg("state")
+    if states is not None:
+        states = [each.lower() for each in states]
+    key = ("status", none_or_tuple(catagories), none_or_tuple(fields), none_or_tuple(states))
+    return view(key, lambda cache: filter_status(cache, catagories, fields, states))
+
+
+def filter_status(cache: dict, catagories: list, fields: list, states: list) -> dict:
+    """Filter the cache for status()"""
+    output = {"output": {}}
+    for each in cache:
+        if (catagories is not None) and (each not in catagories):
+            continue
+        if each == "misc":
+            misc = {}
+            for each1 in cache["misc"]:
+                if (states is None) or (status_state(cache["misc"][each1]["STATUS"]) in states):
+                    misc[each1] = pick_fields(cache["misc"][each1], fields)
+            if misc != {}:
+                output["output"]["misc"] = misc
+        elif (states is None) or (status_state(cache[each]["STATUS"]) in states):
+            output["output"][each] = pick_fields(cache[each], fields)
+    output["return_status"] = 200
+    return output
+
+
+@HERMES.route("/federation/results")
+def federation_results() -> dict:
+    """Results of this node's own checks, for other Hermes nodes to vote with"""
+    output = {"output": single_flight("RESULTS", lambda: ask("OBTAIN_RESULTS"))}
+    output["return_status"] = 200
+    return output
+
+
+@HERMES.route("/admin/profile")
+def profile() -> dict:
+    """Profile a Hermes process for a while, dumping the result to a file.
+       Needs the profiling token, in the X-Hermes-Token header or the `token` argument.
+       Query arguments:
+        - target: "api" (this process) or "workers" (sample mode only), or "checker"
+        - mode: "sample" or "cprofile"
+        - seconds: how long to profile for
+    """
+    if (PROFILING is None) or (PROFILING["token"] is None):
+        return forbidden()
+    token = request.headers.get("X-Hermes-Token", request.args.get("token", ""))
+    if not hmac.compare_digest(token.encode(), PROFILING["token"].encode()):
+        return forbidden()
+    target = request.args.get("target", "api")
+    mode = request.args.get("mode", "sample")
+    try:
+        seconds = float(request.args.get("seconds", 10))
+    except ValueError:
+        return {"return_status": 400, "MESSAGE": "SECONDS MUST BE A NUMBER"}
+    if (not math.isfinite(seconds)) or (seconds <= 0):
+        return {"return_status": 400, "MESSAGE": "SECONDS MUST BE A POSITIVE NUMBER"}
+    if target == "api":
+        try:
+            output = {"output": {"ACCEPTED": profiling.run_timed("api", mode, seconds, PROFILING)}}
+        except ValueError as error:
+            return {"return_status": 400, "MESSAGE": str(error)}
+    else:
+        output = {"output": ask({"PROFILE": {"target": target, "mode": mode, "seconds": seconds}})}
     output["return_status"] = 200
     return output
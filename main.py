@@ -28,9 +28,13 @@ import json
 import subprocess as subproc
 import shutil
 import importlib
+import hashlib
 import common
 
 
+FINGERPRINT_FILE = "hermes_fingerprint.json"
+
+
 def is_running_in_venv() -> bool:
     """Check if we are running in a venv"""
     return hasattr(sys,
@@ -38,6 +42,73 @@ def is_running_in_venv() -> bool:
                                               'base_prefix') and sys.base_prefix != sys.prefix)
 
 
+def file_hash(path: str) -> str:
+    """Get the SHA256 hash of a file's contents"""
+    digest = hashlib.sha256()
+    with open(path, "rb") as file:
+        for chunk in iter(lambda: file.read(65536), b""):
+            digest.update(chunk)
+    return digest.hexdigest()
+
+
+def env_fingerprint(settings: dict) -> str:
+    """Fingerprint everything that requires the venv to be rebuilt when changed:
+       the Python version, the dependency list and where they are installed from.
+    """
+    data = {
+            "python": list(sys.version_info[:3]),
+            "executable": sys.executable,
+            "deps": sorted(settings["deps"]),
+            "wheelhouse": settings["wheelhouse"]
+        }
+    return hashlib.sha256(json.dumps(data, sort_keys=True).encode()).hexdigest()
+
+
+def load_fingerprint(venv: str) -> dict:
+    """Load the fingerprint from the last time the venv was set up"""
+    path = f"./{venv}/{FINGERPRINT_FILE}"
+    if not os.path.exists(path) or not os.path.exists(f"./{venv}/bin/python"):
+        return {"env": None, "files": {}}
+    try:
+        with open(path, "r") as file:
+            return json.load(file)
+    except (json.decoder.JSONDecodeError, OSError):
+        return {"env": None, "files": {}}
+
+
+def setup_venv(settings: dict, fingerprint: dict) -> bool:
+    """Create the venv and install deps into it, unless nothing changed since last time.
+       Returns True if the venv was (re)built, False if it was reused.
+    """
+    env = env_fingerprint(settings)
+    if fingerprint["env"] == env:
+        return False
+    # Start from an empty venv, so removed deps and an old Python's site-packages don't linger.
+    # This also deletes the copied files, which sync_file() notices and copies again.
+    subproc.check_call([sys.executable, "-m", "venv", "--clear", settings["venv_name"]])
+    if settings["deps"] != []:
+        cmd = [f"./{settings['venv_name']}/bin/pip3", "install"]
+        if settings["wheelhouse"] is not None:
+            # Offline install, from pre-built wheels only
+            cmd += ["--no-index", "--find-links", settings["wheelhouse"]]
+        subproc.check_call(cmd + settings["deps"])
+    fingerprint["env"] = env
+    return True
+
+
+def sync_file(src: str, dest: str, fingerprint: dict) -> bool:
+    """Copy src to dest if it has changed since it was last copied.
+       Returns True if the file was copied.
+    """
+    name = dest.split("/")[-1]
+    digest = file_hash(src)
+    if (fingerprint["files"].get(name) == digest) and os.path.exists(dest):
+        return False
+    shutil.copyfile(src, dest)
+    fingerprint["files"][name] = digest
+    return True
+
+
 def main():
     """Entry point"""
     # Try loading settings
@@ -46,6 +117,7 @@ def main():
                 "fork_if_setup": True,
                 "file_list": [each for each in os.listdir() if ".py" == each[-3:]],
                 "deps": [],
+                "wheelhouse": None,
                 "entry_point": {
                             "module": "entry_point",
                             "function": "main"
@@ -68,25 +140,29 @@ def main():
             settings[each] = backup_settings[each]
 
     if not is_running_in_venv():
+        fingerprint = load_fingerprint(settings["venv_name"])
         common.eprint(f"{common.Y}Setting up venv...{common.NC}")
-        subproc.check_call(["python3", "-m", "venv", settings["venv_name"]])
-        cmd = f"bash -c 'source ./{settings['venv_name']}/bin/activate && pip3 install {' '.join(settings['deps'])}'"
-        subproc.check_call(cmd, shell=True)
+        if not setup_venv(settings, fingerprint):
+            common.eprint(f"{common.G}Venv unchanged, reusing it.{common.NC}")
 
         # Copy this file into venv
         main_dest = "./" + settings["venv_name"] + "/" + sys.argv[0].split("/")[-1]
-        shutil.copyfile(sys.argv[0], main_dest)
+        copied = int(sync_file(sys.argv[0], main_dest, fingerprint))
 
         # Copy other files into venv
         for each in settings["file_list"]:
             src = "/".join(sys.argv[0].split("/")[:-1]) + f"/{each}"
             dest = "./" + settings["venv_name"] + f"/{each}"
-            shutil.copyfile(src, dest)
+            copied += int(sync_file(src, dest, fingerprint))
 
         if settings_file is not None:
             source = "/".join(sys.argv[0].split("/")[:-1]) + "/" + settings_file
             settings_dest = "./" + settings["venv_name"] + "/" + settings_file
-            shutil.copyfile(source, settings_dest)
+            copied += int(sync_file(source, settings_dest, fingerprint))
+
+        with open(f"./{settings['venv_name']}/{FINGERPRINT_FILE}", "w") as file:
+            json.dump(fingerprint, file, indent=2)
+        print(f"Copied {copied} changed file(s) into venv")
 
         common.eprint(f"{common.G}Venv ready!{common.NC}")
         if settings["fork_if_setup"]:
@@ -101,3 +177,6 @@ def main():
         entry_function = getattr(entry_module, settings["entry_point"]["function"])
         entry_function()
 
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,207 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+#
+#  notify.py
+#
+#  Copyright 2025 Thomas Castleman <batcastle@draugeros.org>
+#
+#  This program is free software; you can redistribute it and/or modify
+#  it under the terms of the GNU General Public License as published by
+#  the Free Software Foundation; either version 2 of the License, or
+#  (at your option) any later version.
+#
+#  This program is distributed in the hope that it will be useful,
+#  but WITHOUT ANY WARRANTY; without even the implied warranty of
+#  MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+#  GNU General Public License for more details.
+#
+#  You should have received a copy of the GNU General Public License
+#  along with this program; if not, write to the Free Software
+#  Foundation, Inc., 51 Franklin Street, Fifth Floor, Boston,
+#  MA 02110-1301, USA.
+#
+#
+"""Send notifications when a status changes
+
+   check_main() puts status changes on a queue, and a seperate process sends
+   them out, so a slow or broken endpoint can never hold up checking.
+   Changes that happen close together are sent as one batch, and every
+   channel is retried with exponential backoff.
+
+   Settings (under "notify" in settings.json):
+    - enabled: turn notifications on or off
+    - batch_window: seconds to wait for more changes before sending a batch
+    - debounce: seconds to wait after notifying about something before notifying about it again
+    - retries: how many times to retry a failed send
+    - backoff: base of the exponential backoff between retries, in seconds
+    - timeout: seconds to wait for each send to complete
+    - webhooks: list of URLs to POST a JSON body to
+    - smtp: {"host", "port", "from", "to"} to send email, or null
+    - command: command (as a list) to run with the batch as JSON on stdin, or null
+"""
+import multiprocessing as mp
+import asyncio
+import queue
+import time
+import json
+
+
+def enabled(settings: dict) -> bool:
+    """Check if notifications are turned on"""
+    if "notify" not in settings:
+        return False
+    return settings["notify"]["enabled"]
+
+
+def status_text(status) -> str:
+    """Get a STATUS value as text"""
+    if isinstance(status, list):
+        return "SINGLE DOWN: " + ", ".join(status)
+    if isinstance(status, bool):
+        if status:
+            return "UP"
+        return "DOWN"
+    return status
+
+
+def event_name(event: dict) -> str:
+    """Name of what an event is about"""
+    if event["entry"] is None:
+        return event["catagory"]
+    return f"{event['catagory']}/{event['entry']}"
+
+
+def make_event(catagory: str, entry: str, old, new, when: float) -> dict:
+    """Build an event for a status change"""
+    return {"catagory": catagory, "entry": entry, "from": old, "to": new, "time": when}
+
+
+def merge(batch: list, held: dict) -> list:
+    """Collapse several changes to the same thing into one change, from the first
+       old status to the last new status. Changes that end up where they started are dropped.
+    """
+    output = {}
+    for each in batch:
+        name = event_name(each)
+        if name in held:
+            each = dict(each, **{"from": held.pop(name)["from"]})
+        if name in output:
+            each = dict(each, **{"from": output[name]["from"]})
+        output[name] = each
+    return [output[each] for each in output if output[each]["from"] != output[each]["to"]]
+
+
+def send_webhook(url: str, batch: list, timeout: float) -> None:
+    """POST a batch to a webhook"""
+    import urllib3 as url3
+    data = url3.request("POST", url, body=json.dumps({"events": batch}),
+                        headers={"Content-Type": "application/json"},
+                        timeout=timeout, retries=False)
+    if data.status >= 300:
+        raise ConnectionError(f"WEBHOOK RETURNED {data.status}: {url}")
+
+
+def send_email(settings: dict, batch: list, timeout: float) -> None:
+    """Email a batch"""
+    import smtplib
+    from email.message import EmailMessage
+    message = EmailMessage()
+    message["Subject"] = f"Hermes: {len(batch)} status change(s)"
+    message["From"] = settings["from"]
+    message["To"] = ", ".join(settings["to"])
+    message.set_content("\n".join([f"{event_name(each)}: {status_text(each['from'])} -> {status_text(each['to'])}"
+                                   for each in batch]))
+    with smtplib.SMTP(settings["host"], settings["port"], timeout=timeout) as server:
+        server.send_message(message)
+
+
+def run_command(command: list, batch: list, timeout: float) -> None:
+    """Run a local command with a batch as JSON on stdin"""
+    import subprocess as subproc
+    subproc.run(command, input=json.dumps({"events": batch}).encode(), timeout=timeout, check=True)
+
+
+async def send_with_retry(function, args: tuple, settings: dict) -> bool:
+    """Call a blocking send function in a thread, retrying with exponential backoff on failure"""
+    for each in range(settings["retries"] + 1):
+        try:
+            await asyncio.to_thread(function, *args, settings["timeout"])
+            return True
+        except Exception as error:
+            print(f"NOTIFICATION FAILED ({each + 1}/{settings['retries'] + 1}): {error}")
+        if each < settings["retries"]:
+            await asyncio.sleep(settings["backoff"] ** each)
+    return False
+
+
+def dispatch(batch: list, settings: dict) -> list:
+    """Start sending a batch out on every channel. Returns the tasks sending it."""
+    tasks = []
+    for each in settings["webhooks"]:
+        tasks.append(asyncio.create_task(send_with_retry(send_webhook, (each, batch), settings)))
+    if settings["smtp"] is not None:
+        tasks.append(asyncio.create_task(send_with_retry(send_email, (settings["smtp"], batch), settings)))
+    if settings["command"] is not None:
+        tasks.append(asyncio.create_task(send_with_retry(run_command, (settings["command"], batch), settings)))
+    return tasks
+
+
+async def notify_loop(events, settings: dict) -> None:
+    """Collect events into batches and send them out"""
+    loop = asyncio.get_running_loop()
+    last_sent = {}
+    held = {}
+    tasks = set()
+    running = True
+    while running:
+        # Wait for the first event, or until a held event is due
+        timeout = None
+        if held != {}:
+            timeout = max(min(held[each]["due"] for each in held) - time.time(), 0)
+        batch = []
+        try:
+            batch.append(await loop.run_in_executor(None, events.get, True, timeout))
+        except queue.Empty:
+            pass
+        # Gather everything else that happens within the batch window
+        start = time.time()
+        while (batch != []) and (time.time() < start + settings["batch_window"]):
+            try:
+                batch.append(await loop.run_in_executor(None, events.get, True,
+                                                        start + settings["batch_window"] - time.time()))
+            except queue.Empty:
+                break
+        if "SHUTDOWN" in batch:
+            batch.remove("SHUTDOWN")
+            running = False
+        due = [held.pop(each) for each in list(held) if held[each]["due"] <= time.time()]
+        ready = []
+        for each in merge(due + batch, held):
+            name = event_name(each)
+            if (name in last_sent) and (last_sent[name]["to"] == each["to"]):
+                continue
+            if (name in last_sent) and (time.time() < last_sent[name]["time"] + settings["debounce"]):
+                # Notified about this recently, hold on to it until the debounce window is over
+                held[name] = dict(each, due=last_sent[name]["time"] + settings["debounce"])
+                continue
+            last_sent[name] = {"to": each["to"], "time": time.time()}
+            ready.append({key: each[key] for key in each if key != "due"})
+        if ready != []:
+            tasks.update(dispatch(ready, settings))
+        tasks = {each for each in tasks if not each.done()}
+    # Give anything still being sent a chance to finish
+    if tasks != set():
+        await asyncio.wait(tasks, timeout=settings["timeout"])
+
+
+def notify_main(events, settings: dict) -> None:
+    """This is supposed to run as a seperate process. Do not call directly!"""
+    asyncio.run(notify_loop(events, settings))
+
+
+def notify_spawn(settings: dict):
+    """Spawn notify_main() as a seperate process, return the queue to send events to it"""
+    events = mp.Queue()
+    proc = mp.Process(target=notify_main, args=(events, settings["notify"]))
+    proc.start()
+    return (events, proc)
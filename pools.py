@@ -0,0 +1,106 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+#
+#  pools.py
+#
+#  Copyright 2025 Thomas Castleman <batcastle@draugeros.org>
+#
+#  This program is free software; you can redistribute it and/or modify
+#  it under the terms of the GNU General Public License as published by
+#  the Free Software Foundation; either version 2 of the License, or
+#  (at your option) any later version.
+#
+#  This program is distributed in the hope that it will be useful,
+#  but WITHOUT ANY WARRANTY; without even the implied warranty of
+#  MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+#  GNU General Public License for more details.
+#
+#  You should have received a copy of the GNU General Public License
+#  along with this program; if not, write to the Free Software
+#  Foundation, Inc., 51 Franklin Street, Fifth Floor, Boston,
+#  MA 02110-1301, USA.
+#
+#
+"""Rank the members of each pool by how fast and reliable they have been
+
+   Every catagory other than `misc` is a pool. As the checks of a pool come in,
+   the latency and loss of each member is folded into an exponentially weighted
+   moving average, and the healthy members of the pool are sorted best first.
+   The API then only has to slice an already sorted list.
+
+   Settings (under "pools" in settings.json):
+    - alpha: weight of the newest result in the moving averages, between 0 and 1
+    - max_loss: members with an average loss above this are not healthy
+    - loss_penalty: how much loss counts against a member compared to latency
+"""
+
+
+class Rankings():
+    """Ranking of healthy members of every pool"""
+    def __init__(self, settings: dict):
+        """Initalization"""
+        self.settings = settings
+        self.averages = {}
+        self.pools = {}
+        # Targets already folded into the averages this sweep
+        self.recorded = set()
+
+    def score(self, target: tuple) -> float:
+        """Lower is better"""
+        data = self.averages[target]
+        return data["latency"] * (1 + (self.settings["loss_penalty"] * data["loss"]))
+
+    def record(self, target: tuple, outcome: dict) -> None:
+        """Fold the outcome of one check into the averages of a target"""
+        alpha = self.settings["alpha"]
+        if target not in self.averages:
+            self.averages[target] = {"latency": outcome["latency"], "loss": outcome["loss"]}
+            return
+        data = self.averages[target]
+        data["loss"] = (alpha * outcome["loss"]) + ((1 - alpha) * data["loss"])
+        # A failed check has no latency, so only the loss is updated
+        if outcome["latency"] is not None:
+            if data["latency"] is None:
+                data["latency"] = outcome["latency"]
+            else:
+                data["latency"] = (alpha * outcome["latency"]) + ((1 - alpha) * data["latency"])
+
+    def start_sweep(self) -> None:
+        """Forget which targets have been recorded, ready for a new sweep"""
+        self.recorded = set()
+
+    def update(self, to_track: dict, outcomes: dict, results: dict) -> None:
+        """Update the rankings as outcomes come in.
+           `to_track` is the pools to sort again, `outcomes` are the outcomes of checks
+           that just came in, and `results` is the final up or down result for every
+           target checked this sweep. Only pools with a member in `outcomes` are sorted again.
+           A target in several pools is only recorded once per sweep, however often it is passed in.
+        """
+        for each in outcomes:
+            # A probe that timed out was never measured, so there is nothing to record
+            if (each not in self.recorded) and not outcomes[each].get("timed_out", False):
+                self.record(each, outcomes[each])
+                self.recorded.add(each)
+        for each in to_track:
+            if each == "misc":
+                continue
+            members = [(to_track[each]["type"], each1) for each1 in to_track[each]["urls"]]
+            if not any(each1 in outcomes for each1 in members):
+                continue
+            healthy = []
+            for each1 in members:
+                if not results.get(each1, False) or (each1 not in self.averages):
+                    continue
+                data = self.averages[each1]
+                if (data["latency"] is None) or (data["loss"] > self.settings["max_loss"]):
+                    continue
+                healthy.append(each1)
+            healthy.sort(key=self.score)
+            self.pools[each] = [{"url": each1[1],
+                                 "latency": self.averages[each1]["latency"],
+                                 "loss": self.averages[each1]["loss"]} for each1 in healthy]
+
+    def prune(self, to_track: dict) -> None:
+        """Forget pools that are no longer tracked"""
+        for each in [each for each in self.pools if each not in to_track]:
+            del self.pools[each]
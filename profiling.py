@@ -0,0 +1,137 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+#
+#  profiling.py
+#
+#  Copyright 2025 Thomas Castleman <batcastle@draugeros.org>
+#
+#  This program is free software; you can redistribute it and/or modify
+#  it under the terms of the GNU General Public License as published by
+#  the Free Software Foundation; either version 2 of the License, or
+#  (at your option) any later version.
+#
+#  This program is distributed in the hope that it will be useful,
+#  but WITHOUT ANY WARRANTY; without even the implied warranty of
+#  MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+#  GNU General Public License for more details.
+#
+#  You should have received a copy of the GNU General Public License
+#  along with this program; if not, write to the Free Software
+#  Foundation, Inc., 51 Franklin Street, Fifth Floor, Boston,
+#  MA 02110-1301, USA.
+#
+#
+"""Profile a running Hermes process for a while, then dump the results to a file
+
+   Two kinds of profile are supported:
+    - "cprofile": cProfile, for exact call counts and times. Only profiles the
+      thread that started it, so it can't be used on checker workers, whose probes
+      run in a thread pool. Dumped as a .prof file, for pstats or snakeviz.
+    - "sample": samples the stacks of every thread every `interval` seconds.
+      Dumped as folded stacks (.folded), for flamegraph.pl or speedscope.
+   Nothing is running when no profile has been asked for.
+
+   Settings (under "profiling" in settings.json):
+    - token: secret needed to start a profile through the API. null turns the API route off
+    - directory: where to dump profiles
+    - max_seconds: longest profile that can be asked for
+    - interval: seconds between samples in "sample" mode
+"""
+import threading
+import cProfile
+import math
+import time
+import sys
+import os
+
+MODES = ("cprofile", "sample")
+
+
+def clamp_seconds(seconds: float, settings: dict) -> float:
+    """Check how long a profile was asked to run for, and cap it at max_seconds"""
+    if (not math.isfinite(seconds)) or (seconds <= 0):
+        raise ValueError(f"SECONDS MUST BE A POSITIVE NUMBER, NOT: {seconds}")
+    return min(seconds, settings["max_seconds"])
+
+
+class Sampler():
+    """Sample the stack of every thread on a timer"""
+    def __init__(self, interval: float):
+        """Initalization"""
+        self.interval = interval
+        self.counts = {}
+        self.stopped = threading.Event()
+        self.thread = threading.Thread(target=self.run, daemon=True)
+
+    def run(self) -> None:
+        """Take samples until stopped"""
+        own = threading.get_ident()
+        while not self.stopped.wait(self.interval):
+            for ident, frame in sys._current_frames().items():
+                if ident == own:
+                    continue
+                stack = []
+                while frame is not None:
+                    stack.append(f"{frame.f_code.co_name} ({os.path.basename(frame.f_code.co_filename)}:{frame.f_lineno})")
+                    frame = frame.f_back
+                key = ";".join(reversed(stack))
+                self.counts[key] = self.counts.get(key, 0) + 1
+
+    def enable(self) -> None:
+        """Start sampling"""
+        self.thread.start()
+
+    def disable(self) -> None:
+        """Stop sampling"""
+        self.stopped.set()
+        self.thread.join()
+
+    def dump_stats(self, path: str) -> None:
+        """Write out samples as folded stacks"""
+        with open(path, "w") as file:
+            for each in sorted(self.counts, key=lambda key: -self.counts[key]):
+                file.write(f"{each} {self.counts[each]}\n")
+
+
+class Session():
+    """A profile that stops by itself after a number of seconds"""
+    def __init__(self, role: str, mode: str, seconds: float, settings: dict):
+        """Start profiling"""
+        if mode not in MODES:
+            raise ValueError(f"UNKNOWN PROFILE MODE: {mode}")
+        self.mode = mode
+        self.until = time.time() + clamp_seconds(seconds, settings)
+        extension = "prof" if mode == "cprofile" else "folded"
+        self.path = os.path.join(settings["directory"],
+                                 f"{role}-{os.getpid()}-{time.strftime('%Y%m%d-%H%M%S')}.{extension}")
+        if mode == "cprofile":
+            self.profiler = cProfile.Profile()
+        else:
+            self.profiler = Sampler(settings["interval"])
+        self.profiler.enable()
+
+    def expired(self) -> bool:
+        """Check if it's time to stop"""
+        return time.time() >= self.until
+
+    def finish(self) -> str:
+        """Stop profiling and dump the results. Returns the file they were dumped to."""
+        self.profiler.disable()
+        os.makedirs(os.path.dirname(self.path) or ".", exist_ok=True)
+        self.profiler.dump_stats(self.path)
+        print(f"PROFILE WRITTEN: {self.path}")
+        return self.path
+
+
+def run_timed(role: str, mode: str, seconds: float, settings: dict) -> str:
+    """Profile this process in the background, stopping after `seconds`.
+       Only "sample" mode works here, as cProfile has to be stopped by the thread that started it.
+       Returns the file the profile will be dumped to.
+    """
+    if mode != "sample":
+        raise ValueError(f"ONLY SAMPLE MODE CAN BE USED HERE, NOT: {mode}")
+    session = Session(role, mode, seconds, settings)
+    timer = threading.Timer(session.until - time.time(), session.finish)
+    timer.daemon = True
+    timer.start()
+    return session.path
@@ -0,0 +1,144 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+#
+#  ratelimit.py
+#
+#  Copyright 2025 Thomas Castleman <batcastle@draugeros.org>
+#
+#  This program is free software; you can redistribute it and/or modify
+#  it under the terms of the GNU General Public License as published by
+#  the Free Software Foundation; either version 2 of the License, or
+#  (at your option) any later version.
+#
+#  This program is distributed in the hope that it will be useful,
+#  but WITHOUT ANY WARRANTY; without even the implied warranty of
+#  MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+#  GNU General Public License for more details.
+#
+#  You should have received a copy of the GNU General Public License
+#  along with this program; if not, write to the Free Software
+#  Foundation, Inc., 51 Franklin Street, Fifth Floor, Boston,
+#  MA 02110-1301, USA.
+#
+#
+"""Limit how fast probes are sent, so Hermes does not trip upstream rate
+   limits or ICMP throttling and then report the resulting loss as downtime.
+
+   Settings (under "rate_limit" in settings.json), 0 means unlimited:
+    - concurrency: how many probes each checker worker runs at once
+    - global_pps: packets per second, shared between all checker workers
+    - burst: how many packets may be sent at once before global_pps applies
+    - per_host: how many probes (of any type) may run against one host at once
+    - per_subnet: how many probes may run against one /24 (or IPv6 /64) at once.
+      Hosts in one subnet can be spread over several workers, so this is per worker.
+"""
+import threading
+import ipaddress
+import socket
+import time
+
+
+class TokenBucket():
+    """Allow `rate` tokens per second, with up to `burst` available at once"""
+    def __init__(self, rate: float, burst: float):
+        """Initalization"""
+        self.rate = rate
+        self.burst = max(burst, 1)
+        self.tokens = self.burst
+        self.updated = time.monotonic()
+        self.lock = threading.Lock()
+
+    def acquire(self, tokens: float=1) -> None:
+        """Wait until `tokens` tokens are available, then take them"""
+        if self.rate <= 0:
+            return
+        # Asking for more than the bucket can hold would wait forever, so only wait
+        # for it to fill and go into debt for the rest
+        needed = min(tokens, self.burst)
+        while True:
+            with self.lock:
+                now = time.monotonic()
+                self.tokens = min(self.burst, self.tokens + ((now - self.updated) * self.rate))
+                self.updated = now
+                if self.tokens >= needed:
+                    self.tokens -= tokens
+                    return
+                wait = (needed - self.tokens) / self.rate
+            time.sleep(wait)
+
+
+class KeyedLimiter():
+    """Allow at most `limit` holders at once for each key"""
+    def __init__(self, limit: int):
+        """Initalization"""
+        self.limit = limit
+        self.semaphores = {}
+        self.lock = threading.Lock()
+
+    def acquire(self, key: str) -> None:
+        """Wait for a free slot for `key`"""
+        if self.limit <= 0:
+            return
+        with self.lock:
+            if key not in self.semaphores:
+                self.semaphores[key] = threading.BoundedSemaphore(self.limit)
+            semaphore = self.semaphores[key]
+        semaphore.acquire()
+
+    def release(self, key: str) -> None:
+        """Free up a slot for `key`"""
+        if self.limit <= 0:
+            return
+        self.semaphores[key].release()
+
+
+def subnet(host: str) -> str:
+    """Get the /24 (or /64 for IPv6) a host is in.
+       If it can't be resolved, the host itself is used instead.
+    """
+    try:
+        address = socket.getaddrinfo(host, None)[0][4][0]
+    except (socket.gaierror, IndexError, UnicodeError):
+        return host
+    if ":" in address:
+        return str(ipaddress.ip_network(f"{address}/64", strict=False))
+    return str(ipaddress.ip_network(f"{address}/24", strict=False))
+
+
+class ProbeLimiter():
+    """All the limits a probe has to respect before it can be sent"""
+    def __init__(self, settings: dict):
+        """Initalization"""
+        self.bucket = TokenBucket(settings["global_pps"], settings["burst"])
+        self.hosts = KeyedLimiter(settings["per_host"])
+        self.subnets = KeyedLimiter(settings["per_subnet"])
+        self.subnet_cache = {}
+
+    def acquire(self, host: str, packets: int) -> str:
+        """Wait until a probe sending `packets` packets to `host` is allowed.
+           Returns the subnet it was counted against, to pass to release().
+        """
+        if self.subnets.limit > 0:
+            if host not in self.subnet_cache:
+                self.subnet_cache[host] = subnet(host)
+            net = self.subnet_cache[host]
+        else:
+            net = host
+        self.hosts.acquire(host)
+        self.subnets.acquire(net)
+        self.bucket.acquire(packets)
+        return net
+
+    def release(self, host: str, net: str) -> None:
+        """Mark a probe as finished"""
+        self.subnets.release(net)
+        self.hosts.release(host)
+
+
+def split(settings: dict, workers: int) -> dict:
+    """Share global rate limits between several workers"""
+    output = dict(settings)
+    if workers > 1:
+        output["global_pps"] = settings["global_pps"] / workers
+        output["burst"] = max(settings["burst"] / workers, 1)
+    return output
@@ -0,0 +1,330 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+#
+#  simulate.py
+#
+#  Copyright 2025 Thomas Castleman <batcastle@draugeros.org>
+#
+#  This program is free software; you can redistribute it and/or modify
+#  it under the terms of the GNU General Public License as published by
+#  the Free Software Foundation; either version 2 of the License, or
+#  (at your option) any later version.
+#
+#  This program is distributed in the hope that it will be useful,
+#  but WITHOUT ANY WARRANTY; without even the implied warranty of
+#  MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+#  GNU General Public License for more details.
+#
+#  You should have received a copy of the GNU General Public License
+#  along with this program; if not, write to the Free Software
+#  Foundation, Inc., 51 Franklin Street, Fifth Floor, Boston,
+#  MA 02110-1301, USA.
+#
+#
+"""Record, replay or make up check outcomes, to load test Hermes without real hosts
+
+   In "record" mode, check_main() writes the outcome of every real check
+   to a trace file once each sweep is done, including checks that timed out. In "replay" mode, check_main() takes outcomes from that
+   trace file instead of checking anything. In "synthetic" mode, outcomes for
+   thousands of made up targets are generated from a seed, including outages.
+
+   Replay and synthetic modes run on a virtual clock, which moves forward by
+   exactly check_freq for every sweep, up to `speed` times faster than real
+   time, so a month of history can be pushed through check_main(),
+   comms.Duplex and hermes_api in minutes. Sweeps happen at the same virtual
+   times however busy the machine is, and outcomes only depend on the seed or
+   the trace and the virtual time, so runs are repeatable.
+
+   Settings (under "simulation" in settings.json):
+    - mode: "off", "record", "replay" or "synthetic"
+    - trace: trace file to write to or read from
+    - speed: how much faster than real time the virtual clock may run, at most
+    - start: virtual time to start at. null means now, or the start of the trace when replaying
+    - length: virtual seconds to sweep for before stopping. null means forever
+    - seed: seed for synthetic outcomes
+    - targets: how many synthetic targets to make
+    - pool_size: how many synthetic targets go in each catagory
+    - outage_rate: chance of a synthetic target being down in each outage_length window
+    - outage_length: length of synthetic outages, in seconds
+    - latency: average latency of synthetic targets, in milliseconds
+
+   Run this file directly to measure CPU time, memory and API latency of a simulated run.
+"""
+import bisect
+import json
+import time
+import os
+import common
+
+
+def mode(settings: dict) -> str:
+    """Get the simulation mode"""
+    if "simulation" not in settings:
+        return "off"
+    return settings["simulation"]["mode"]
+
+
+def speed(settings: dict) -> float:
+    """Get how much faster than real time the clock runs"""
+    if mode(settings) in ("replay", "synthetic"):
+        return settings["simulation"]["speed"]
+    return 1
+
+
+class VirtualClock():
+    """Virtual time, which only moves when a sweep is done"""
+    def __init__(self, start: float, rate: float, length: float=None):
+        """Initalization"""
+        self.start = start
+        self.time = start
+        self.rate = rate
+        self.length = length
+        self.real_start = time.monotonic()
+
+    def __call__(self) -> float:
+        """Get the current virtual time"""
+        return self.time
+
+    def advance(self, seconds: float) -> None:
+        """Move virtual time forward"""
+        self.time += seconds
+
+    def due(self) -> bool:
+        """Check if real time has caught up with virtual time, at `rate` times real time,
+           and the run is not over yet
+        """
+        if (self.length is not None) and ((self.time - self.start) > self.length):
+            return False
+        return ((time.monotonic() - self.real_start) * self.rate) >= (self.time - self.start)
+
+
+def make_clock(settings: dict, simulator=None):
+    """Get a function that returns the current (possibly virtual) time"""
+    if mode(settings) not in ("replay", "synthetic"):
+        return time.time
+    start = settings["simulation"]["start"]
+    if start is None:
+        start = getattr(simulator, "start", None)
+    if start is None:
+        start = time.time()
+    return VirtualClock(start, settings["simulation"]["speed"], settings["simulation"].get("length"))
+
+
+def due(clock) -> bool:
+    """Check if the clock allows a sweep to start yet. Real time always does."""
+    if isinstance(clock, VirtualClock):
+        return clock.due()
+    return True
+
+
+def tick(clock, seconds: float) -> None:
+    """A sweep is done, move virtual time on to when the next one is due. Real time moves by itself."""
+    if isinstance(clock, VirtualClock):
+        clock.advance(seconds)
+
+
+def record(path: str, when: float, outcomes: dict) -> None:
+    """Append the outcomes of a sweep to a trace file, one JSON line per target"""
+    lines = []
+    for each in outcomes:
+        lines.append(json.dumps(dict(outcomes[each], time=when, type=each[0], url=each[1])) + "\n")
+    with open(path, "a") as file:
+        file.write("".join(lines))
+
+
+def synthetic_track(settings: dict) -> dict:
+    """Make up tracking info for the synthetic targets"""
+    sim = settings["simulation"]
+    to_track = {}
+    for each in range(sim["targets"]):
+        name = f"sim_pool_{each // sim['pool_size']}"
+        if name not in to_track:
+            to_track[name] = {"urls": [], "all": "down", "some": "degraded", "type": "simple"}
+        to_track[name]["urls"].append(f"host{each}.sim.invalid")
+    return to_track
+
+
+class Replay():
+    """Outcomes taken from a trace file"""
+    def __init__(self, path: str):
+        """Load and index the trace file"""
+        self.times = {}
+        self.outcomes = {}
+        with open(path, "r") as file:
+            for line in file:
+                if line.strip() == "":
+                    continue
+                data = json.loads(line)
+                target = (data["type"], data["url"])
+                if target not in self.times:
+                    self.times[target] = []
+                    self.outcomes[target] = []
+                self.times[target].append(data["time"])
+                outcome = {"up": data["up"], "latency": data["latency"], "loss": data["loss"]}
+                if data.get("timed_out", False):
+                    outcome["timed_out"] = True
+                self.outcomes[target].append(outcome)
+        for each in self.times:
+            order = sorted(range(len(self.times[each])), key=lambda index: self.times[each][index])
+            self.times[each] = [self.times[each][index] for index in order]
+            self.outcomes[each] = [self.outcomes[each][index] for index in order]
+        self.start = None
+        if self.times != {}:
+            self.start = min(self.times[each][0] for each in self.times)
+
+    def outcome(self, target: tuple, when: float) -> dict:
+        """Get the last recorded outcome for a target at or before `when`.
+           Targets not in the trace are down.
+        """
+        if target not in self.times:
+            return {"up": False, "latency": None, "loss": 1.0}
+        index = max(bisect.bisect_right(self.times[target], when) - 1, 0)
+        return self.outcomes[target][index]
+
+
+class Synthetic():
+    """Outcomes made up from a seed"""
+    def __init__(self, settings: dict):
+        """Initalization"""
+        self.settings = settings
+        self.start = None
+
+    def roll(self, *args) -> float:
+        """Get a repeatable random number in [0, 1) for the given arguments"""
+        key = ":".join([str(self.settings["seed"])] + [str(each) for each in args])
+        return common.stable_hash(key) / (2 ** 64)
+
+    def outcome(self, target: tuple, when: float) -> dict:
+        """Get the outcome of a target at `when`"""
+        window = int(when // self.settings["outage_length"])
+        if self.roll(target[1], window) < self.settings["outage_rate"]:
+            return {"up": False, "latency": None, "loss": 1.0}
+        # Every target has it's own typical latency, with some jitter on each check
+        base = self.settings["latency"] * (0.5 + self.roll(target[1]))
+        latency = base * (0.8 + (0.4 * self.roll(target[1], when)))
+        return {"up": True, "latency": latency, "loss": 0.0}
+
+
+def make_simulator(settings: dict):
+    """Get the simulator for the current mode, or None if outcomes should come from real checks"""
+    if mode(settings) == "replay":
+        return Replay(settings["simulation"]["trace"])
+    if mode(settings) == "synthetic":
+        return Synthetic(settings["simulation"])
+    return None
+
+
+def sweep(simulator, targets: list, when: float) -> dict:
+    """Get the outcome of every target at `when`"""
+    return {each: simulator.outcome(each, when) for each in targets}
+
+
+def proc_usage(pid: int) -> dict:
+    """Get the CPU time and peak memory use of a running process, from /proc"""
+    with open(f"/proc/{pid}/stat", "r") as file:
+        fields = file.read().rsplit(")", 1)[1].split()
+    ticks = os.sysconf("SC_CLK_TCK")
+    peak = None
+    with open(f"/proc/{pid}/status", "r") as file:
+        for line in file:
+            if line.startswith("VmHWM:"):
+                peak = int(line.split()[1])
+    return {"cpu_seconds": (int(fields[11]) + int(fields[12])) / ticks, "max_rss_kb": peak}
+
+
+def benchmark(settings: dict, to_track: dict, duration: float, clients: int=4) -> dict:
+    """Run check_main() and hermes_api against simulated outcomes for `duration` virtual seconds,
+       with `clients` threads reading /status the whole time. Returns what it measured.
+    """
+    import threading
+    import resource
+    import check
+    import hermes_api as api
+    # Pin down when the run starts, so it is known when it ends
+    start = settings["simulation"]["start"]
+    if start is None:
+        start = getattr(make_simulator(settings), "start", None)
+    if start is None:
+        start = time.time()
+    settings = dict(settings, simulation=dict(settings["simulation"], start=start, length=duration))
+    checker = check.UptimeChecker(settings["key_len"])
+    for each in ({"SETTINGS": settings}, {"TO_TRACK": to_track}, "START"):
+        response = checker.recv(checker.send(each), timeout=30)
+        if response != "ACCEPTED":
+            raise RuntimeError(f"INVALID RESPONSE: {response}")
+    api.init([], checker, settings["api_cache_ttl"])
+    latencies = []
+    done = threading.Event()
+    real_start = time.monotonic()
+
+    def client():
+        """Read the API until the run is over"""
+        http = api.HERMES.test_client()
+        while not done.is_set():
+            sent = time.perf_counter()
+            http.get("/status?state=down,degraded&fields=STATUS,SINCE")
+            latencies.append((time.perf_counter() - sent) * 1000)
+
+    threads = [threading.Thread(target=client) for each in range(clients)]
+    for each in threads:
+        each.start()
+    # Run until the last sweep within `duration` virtual seconds is done, however long that takes in real time
+    last = start + duration - (duration % settings["check_freq"])
+    while True:
+        data = api.snapshot()
+        if data["TIME"] >= last:
+            break
+        time.sleep(0.05)
+    done.set()
+    for each in threads:
+        each.join()
+    updates = data["GENERATION"]
+    # check_main() is not our direct child under forkserver, so ask /proc instead of getrusage()
+    checker_usage = proc_usage(checker.proc.pid)
+    checker.destruct()
+    self_usage = resource.getrusage(resource.RUSAGE_SELF)
+    latencies.sort()
+    return {
+            "virtual_seconds": duration,
+            "real_seconds": time.monotonic() - real_start,
+            "targets": len(check.build_targets(to_track)),
+            "sweeps": round((data["TIME"] - start) / settings["check_freq"]) + 1,
+            "cache_updates": updates,
+            "down_at_end": len([each for each in data["CACHE"] if (each != "misc") and (data["CACHE"][each]["STATUS"] != "UP")]),
+            "requests": len(latencies),
+            "latency_ms": {
+                    "p50": latencies[len(latencies) // 2] if latencies != [] else None,
+                    "p99": latencies[int(len(latencies) * 0.99)] if latencies != [] else None,
+                    "max": latencies[-1] if latencies != [] else None
+                },
+            "cpu_seconds": {
+                    "api": self_usage.ru_utime + self_usage.ru_stime,
+                    "checker": checker_usage["cpu_seconds"]
+                },
+            "max_rss_kb": {
+                    "api": self_usage.ru_maxrss,
+                    "checker": checker_usage["max_rss_kb"]
+                }
+        }
+
+
+if __name__ == "__main__":
+    # Usage: simulate.py [virtual seconds to run for, default one day]
+    import sys
+    import multiprocessing as mp
+    with open("settings.json", "r") as file:
+        settings = json.load(file)
+    if mode(settings) not in ("replay", "synthetic"):
+        common.eprint("Set simulation.mode to \"replay\" or \"synthetic\" in settings.json first!")
+        sys.exit(1)
+    mp.set_start_method(settings.get("start_method", "forkserver"))
+    settings["cache_to_disk"] = False
+    if mode(settings) == "synthetic":
+        to_track = synthetic_track(settings)
+    else:
+        with open("track.json", "r") as file:
+            to_track = json.load(file)
+    duration = 86400
+    if len(sys.argv) > 1:
+        duration = float(sys.argv[1])
+    print(json.dumps(benchmark(settings, to_track, duration), indent=2))